@@ -1,4 +1,4 @@
-from typing import Callable, Optional, Tuple
+from typing import Callable, Dict, Optional, Tuple
 
 import numpy as np
 import torch
@@ -6,6 +6,25 @@ import torch.nn as nn
 from torchmcubes import marching_cubes
 import logging
 
+logger = logging.getLogger(__name__)
+
+# whether the installed torchmcubes build has a CUDA kernel, probed once per device
+_cuda_mc_supported: Dict[torch.device, bool] = {}
+
+
+def cuda_marching_cubes_supported(device: torch.device) -> bool:
+    if device not in _cuda_mc_supported:
+        try:
+            marching_cubes(torch.zeros(2, 2, 2, device=device), 0.5)
+            _cuda_mc_supported[device] = True
+        except RuntimeError as e:
+            logger.warning(
+                "CUDA marching cubes unavailable (%s), falling back to CPU.", e
+            )
+            _cuda_mc_supported[device] = False
+    return _cuda_mc_supported[device]
+
+
 class IsosurfaceHelper(nn.Module):
     points_range: Tuple[float, float] = (0, 1)
 
@@ -16,15 +35,10 @@ class IsosurfaceHelper(nn.Module):
 
 class MarchingCubeHelper(IsosurfaceHelper):
     def __init__(self, resolution: int) -> None:
-        logging.info('Initializing MarchingCubeHelper...')
-        try:
-            super().__init__()
-            self.resolution = resolution
-            self.mc_func: Callable = marching_cubes
-            self._grid_vertices: Optional[torch.FloatTensor] = None
-            logging.info('MarchingCubeHelper initialized successfully.')
-        except Exception as e:
-            logging.error('Failed to initialize MarchingCubeHelper: %s', e)
+        super().__init__()
+        self.resolution = resolution
+        self.mc_func: Callable = marching_cubes
+        self._grid_vertices: Optional[torch.FloatTensor] = None
 
     @property
     def grid_vertices(self) -> torch.FloatTensor:
@@ -45,9 +59,22 @@ class MarchingCubeHelper(IsosurfaceHelper):
     def forward(
         self,
         level: torch.FloatTensor,
+        iso: float = 0.0,
+        sign: int = -1,
     ) -> Tuple[torch.FloatTensor, torch.LongTensor]:
-        level = -level.view(self.resolution, self.resolution, self.resolution)
-        v_pos, t_pos_idx = self.mc_func(level.detach(), 0.0)
+        # extracts the surface where level == iso; sign=-1 treats level as negative inside
+        # (the default, e.g. -(density - threshold)), sign=1 as positive inside (e.g. density),
+        # which avoids materializing a shifted and negated copy of the volume
+        level = level.view(self.resolution, self.resolution, self.resolution)
+        if sign < 0:
+            level, iso = -level, -iso
+        # torchmcubes runs its CUDA kernel when given a CUDA volume, so the grid
+        # never leaves the device; fall back to CPU for builds without CUDA support
+        if level.is_cuda and not cuda_marching_cubes_supported(level.device):
+            v_pos, t_pos_idx = self.mc_func(level.detach().cpu(), iso)
+            v_pos, t_pos_idx = v_pos.to(level.device), t_pos_idx.to(level.device)
+        else:
+            v_pos, t_pos_idx = self.mc_func(level.detach(), iso)
         v_pos = v_pos[..., [2, 1, 0]]
         v_pos = v_pos / (self.resolution - 1.0)
         return v_pos, t_pos_idx
@@ -44,14 +44,26 @@ class TriplaneNeRFRenderer(BaseModule):
         positions: torch.Tensor,
         triplane: torch.Tensor,
     ) -> Dict[str, torch.Tensor]:
+        # a batch of triplanes (B, Np, Cp, Hp, Wp) is queried with positions (B, ..., 3),
+        # internally points are laid out as (N, B, 3) so chunking splits along N
+        batched = triplane.ndim == 5
         input_shape = positions.shape[:-1]
-        positions = positions.view(-1, 3)
+        if batched:
+            positions = rearrange(
+                positions.reshape(triplane.shape[0], -1, 3), "B N Nd -> N B Nd"
+            )
+        else:
+            triplane = triplane[None]
+            positions = positions.reshape(-1, 1, 3)
 
         # positions in (-radius, radius)
         # normalized to (-1, 1) for grid sample
         positions = scale_tensor(
             positions, (-self.cfg.radius, self.cfg.radius), (-1, 1)
         )
+        # triplanes may be stored in reduced precision (storage only), they are upcast to
+        # the query precision before sampling since bf16 sample coordinates are too coarse
+        triplane = triplane.to(positions.dtype)
 
         def _query_chunk(x):
             indices2D: torch.Tensor = torch.stack(
@@ -59,15 +71,15 @@ class TriplaneNeRFRenderer(BaseModule):
                 dim=-3,
             )
             out: torch.Tensor = F.grid_sample(
-                rearrange(triplane, "Np Cp Hp Wp -> Np Cp Hp Wp", Np=3),
-                rearrange(indices2D, "Np N Nd -> Np () N Nd", Np=3),
+                rearrange(triplane, "B Np Cp Hp Wp -> (B Np) Cp Hp Wp", Np=3),
+                rearrange(indices2D, "N Np B Nd -> (B Np) () N Nd", Np=3),
                 align_corners=False,
                 mode="bilinear",
             )
             if self.cfg.feature_reduction == "concat":
-                out = rearrange(out, "Np Cp () N -> N (Np Cp)", Np=3)
+                out = rearrange(out, "(B Np) Cp () N -> N B (Np Cp)", Np=3)
             elif self.cfg.feature_reduction == "mean":
-                out = reduce(out, "Np Cp () N -> N Cp", Np=3, reduction="mean")
+                out = reduce(out, "(B Np) Cp () N -> N B Cp", Np=3, reduction="mean")
             else:
                 raise NotImplementedError
 
@@ -79,14 +91,18 @@ class TriplaneNeRFRenderer(BaseModule):
         else:
             net_out = _query_chunk(positions)
 
+        # the decoder produces density in fp32 (see NeRFMLP), keep the activation in fp32 too
         net_out["density_act"] = get_activation(self.cfg.density_activation)(
-            net_out["density"] + self.cfg.density_bias
+            net_out["density"].float() + self.cfg.density_bias
         )
         net_out["color"] = get_activation(self.cfg.color_activation)(
             net_out["features"]
         )
 
-        net_out = {k: v.view(*input_shape, -1) for k, v in net_out.items()}
+        net_out = {
+            k: rearrange(v, "N B C -> B N C").reshape(*input_shape, -1)
+            for k, v in net_out.items()
+        }
 
         return net_out
 
@@ -98,9 +114,11 @@ class TriplaneNeRFRenderer(BaseModule):
         rays_d: torch.Tensor,
         **kwargs,
     ):
+        # rays may carry leading view dims, e.g. (N_views, H, W, 3), and be
+        # expanded (non-contiguous), so flatten with reshape rather than view
         rays_shape = rays_o.shape[:-1]
-        rays_o = rays_o.view(-1, 3)
-        rays_d = rays_d.view(-1, 3)
+        rays_o = rays_o.reshape(-1, 3)
+        rays_d = rays_d.reshape(-1, 3)
         n_rays = rays_o.shape[0]
 
         t_near, t_far, rays_valid = rays_intersect_bbox(rays_o, rays_d, self.cfg.radius)
@@ -157,7 +175,7 @@ class TriplaneNeRFRenderer(BaseModule):
         triplane: torch.Tensor,
         rays_o: torch.Tensor,
         rays_d: torch.Tensor,
-    ) -> Dict[str, torch.Tensor]:
+    ) -> torch.Tensor:
         if triplane.ndim == 4:
             comp_rgb = self._forward(decoder, triplane, rays_o, rays_d)
         else:
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, Optional
 
 import torch
 import torch.nn as nn
@@ -8,6 +8,15 @@ from einops import rearrange
 from ..utils import BaseModule
 
 
+def is_autocast_enabled(device_type: str) -> bool:
+    # torch >= 2.4 takes the device type, older versions have per-device functions
+    if hasattr(torch, "get_autocast_dtype"):
+        return torch.is_autocast_enabled(device_type)
+    if device_type == "cuda":
+        return torch.is_autocast_enabled()
+    return torch.is_autocast_cpu_enabled()
+
+
 class TriplaneUpsampleNetwork(BaseModule):
     @dataclass
     class Config(BaseModule.Config):
@@ -113,12 +122,31 @@ class NeRFMLP(BaseModule):
         else:
             raise NotImplementedError
 
-    def forward(self, x):
-        inp_shape = x.shape[:-1]
+    def forward(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        # kept TorchScript-compatible, see TSR.Config.jit_renderer
+        inp_shape = list(x.shape[:-1])
         x = x.reshape(-1, x.shape[-1])
 
-        features = self.layers(x)
-        features = features.reshape(*inp_shape, -1)
+        if torch.jit.is_scripting():
+            features = self.layers(x)
+        else:
+            features = self._forward_eager(x)
+        features = features.reshape(inp_shape + [-1])
         out = {"density": features[..., 0:1], "features": features[..., 1:4]}
 
         return out
+
+    @torch.jit.unused
+    def _forward_eager(self, x: torch.Tensor) -> torch.Tensor:
+        if not is_autocast_enabled(x.device.type):
+            return self.layers(x)
+
+        # hidden layers follow autocast, the output layer runs with autocast disabled
+        # at the weights' precision, since marching cubes is sensitive to density
+        head = self.layers[-1]
+        for layer in self.layers:
+            if layer is head:
+                break
+            x = layer(x)
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            return head(x.to(head.weight.dtype))
@@ -1,7 +1,7 @@
 import math
 import os
 from dataclasses import dataclass, field
-from typing import List, Union
+from typing import Dict, List, Optional, OrderedDict, Tuple, Union
 import logging
 
 
@@ -10,7 +10,6 @@ import PIL.Image
 import torch
 import torch.nn.functional as F
 import trimesh
-from einops import rearrange
 from huggingface_hub import hf_hub_download
 from omegaconf import OmegaConf
 from PIL import Image
@@ -19,11 +18,23 @@ from .models.isosurface import MarchingCubeHelper
 from .utils import (
     BaseModule,
     ImagePreprocessor,
+    chunk_batch,
+    compile_fn,
     find_class,
     get_spherical_cameras,
+    jit_module,
     scale_tensor,
 )
 
+logger = logging.getLogger(__name__)
+
+
+PRECISION_DTYPES = {
+    "fp32": torch.float32,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
 
 class TSR(BaseModule):
     @dataclass
@@ -48,20 +59,36 @@ class TSR(BaseModule):
         renderer_cls: str
         renderer: dict
 
+        # script the decoder and compile the renderer to fuse per-sample kernels
+        jit_renderer: bool = False
+
+        # inference precision, one of "fp32", "fp16" or "bf16" (autocast)
+        precision: str = "fp32"
+        # storage precision of the scene codes (triplanes) returned by forward(); this
+        # only saves memory for kept scene codes, queries upcast them before sampling
+        triplane_precision: str = "fp32"
+
     cfg: Config
+
+    # number of camera settings whose rays are kept on device
+    ray_cache_size: int = 8
     
     @classmethod
     def from_pretrained(
-            cls, weight_path: str, config_path: str
+            cls, weight_path: str, config_path: str, triplane_precision: Optional[str] = None
     ):
         cfg = OmegaConf.load(config_path)
         OmegaConf.resolve(cfg)
+        if triplane_precision is not None:
+            cfg.triplane_precision = triplane_precision
         model = cls(cfg)
         ckpt = torch.load(weight_path, map_location="cpu")
         model.load_state_dict(ckpt)
         return model
 
     def configure(self):
+        assert self.cfg.precision in PRECISION_DTYPES
+        assert self.cfg.triplane_precision in PRECISION_DTYPES
         self.image_tokenizer = find_class(self.cfg.image_tokenizer_cls)(
             self.cfg.image_tokenizer
         )
@@ -72,8 +99,53 @@ class TSR(BaseModule):
         )
         self.decoder = find_class(self.cfg.decoder_cls)(self.cfg.decoder)
         self.renderer = find_class(self.cfg.renderer_cls)(self.cfg.renderer)
+        if self.cfg.jit_renderer:
+            if self.cfg.precision == "fp32":
+                self.decoder = jit_module(self.decoder)
+            else:
+                # scripting skips the decoder's fp32 output layer, which relies on
+                # eager autocast control, so compile it instead under autocast
+                self.decoder.forward = compile_fn(
+                    self.decoder.forward, fullgraph=False, dynamic=False
+                )
+            # the renderer is not scriptable (closures, einops, chunk_batch)
+            self.renderer.forward = compile_fn(
+                self.renderer.forward, fullgraph=False, dynamic=False
+            )
         self.image_processor = ImagePreprocessor()
         self.isosurface_helper = None
+        self._scaled_grid_vertices: Optional[torch.Tensor] = None
+        # LRU: hits move to the end, the oldest entry is evicted first
+        self._ray_cache: OrderedDict[
+            tuple, Tuple[torch.Tensor, torch.Tensor]
+        ] = OrderedDict()
+        self._density_graphs: Dict[tuple, tuple] = {}
+        self._cpu_pool: Dict[str, Optional[torch.Tensor]] = {
+            "v": None,
+            "f": None,
+            "c": None,
+        }
+
+    def _apply(self, fn, *args, **kwargs):
+        # device caches are not parameters or buffers, drop them when the model is moved
+        self._ray_cache.clear()
+        self._scaled_grid_vertices = None
+        self.release_cuda_graphs()
+        return super()._apply(fn, *args, **kwargs)
+
+    @property
+    def _amp_dtype(self) -> Optional[torch.dtype]:
+        if self.cfg.precision == "fp32":
+            return None
+        return PRECISION_DTYPES[self.cfg.precision]
+
+    def autocast(self, device: Union[str, torch.device], **kwargs):
+        return torch.autocast(
+            device_type=torch.device(device).type,
+            dtype=self._amp_dtype,
+            enabled=self._amp_dtype is not None,
+            **kwargs,
+        )
 
     def forward(
         self,
@@ -87,29 +159,97 @@ class TSR(BaseModule):
         ],
         device: str,
     ) -> torch.FloatTensor:
-        rgb_cond = self.image_processor(image, self.cfg.cond_image_size)[:, None].to(
+        # stays fp32, the tokenizer normalizes with fp32 buffers and autocast
+        # handles the reduced-precision convs and matmuls
+        rgb_cond = self.image_processor(image, self.cfg.cond_image_size, device).to(
             device
         )
+        scene_codes = self.encode(rgb_cond)
+        # always copy, so scene codes never alias buffers owned by a compiled encode()
+        return scene_codes.to(
+            PRECISION_DTYPES[self.cfg.triplane_precision], copy=True
+        )
+
+    def encode(self, rgb_cond: torch.Tensor) -> torch.Tensor:
         batch_size = rgb_cond.shape[0]
 
-        input_image_tokens: torch.Tensor = self.image_tokenizer(
-            rearrange(rgb_cond, "B Nv H W C -> B Nv C H W", Nv=1),
-        )
+        with self.autocast(rgb_cond.device):
+            # single view per scene: B H W C -> B C H W, tokens B C Nt -> B Nt C
+            input_image_tokens: torch.Tensor = self.image_tokenizer(
+                rgb_cond.permute(0, 3, 1, 2),
+            )
 
-        input_image_tokens = rearrange(
-            input_image_tokens, "B Nv C Nt -> B (Nv Nt) C", Nv=1
-        )
+            input_image_tokens = input_image_tokens.transpose(1, 2)
 
-        tokens: torch.Tensor = self.tokenizer(batch_size)
+            tokens: torch.Tensor = self.tokenizer(batch_size)
 
-        tokens = self.backbone(
-            tokens,
-            encoder_hidden_states=input_image_tokens,
-        )
+            tokens = self.backbone(
+                tokens,
+                encoder_hidden_states=input_image_tokens,
+            )
 
-        scene_codes = self.post_processor(self.tokenizer.detokenize(tokens))
+            scene_codes = self.post_processor(self.tokenizer.detokenize(tokens))
         return scene_codes
 
+    def compile_model(
+        self,
+        mode: str = "reduce-overhead",
+        dynamic: bool = False,
+        fullgraph: bool = False,
+    ) -> "TSR":
+        """
+        Compile the image-to-triplane network (encode) and the renderer with
+        torch.compile. Image preprocessing stays eager, and anything already
+        compiled (e.g. through jit_renderer) is left as is. Shapes are treated as
+        static, so the first call with a new batch size (or render resolution)
+        triggers a recompilation.
+        """
+        self.encode = compile_fn(
+            self.encode, mode=mode, dynamic=dynamic, fullgraph=fullgraph
+        )
+        self.renderer.forward = compile_fn(
+            self.renderer.forward, mode=mode, dynamic=dynamic, fullgraph=fullgraph
+        )
+        return self
+
+    def get_spherical_rays(
+        self,
+        n_views: int,
+        elevation_deg: float,
+        camera_distance: float,
+        fovy_deg: float,
+        height: int,
+        width: int,
+        device: torch.device,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        key = (
+            n_views,
+            elevation_deg,
+            camera_distance,
+            fovy_deg,
+            height,
+            width,
+            str(device),
+        )
+        if key in self._ray_cache:
+            self._ray_cache.move_to_end(key)
+        else:
+            rays_o, rays_d = get_spherical_cameras(
+                n_views, elevation_deg, camera_distance, fovy_deg, height, width
+            )
+            if torch.device(device).type == "cuda":
+                # pinned source memory lets the host-to-device copies run async
+                rays_o = rays_o.contiguous().pin_memory()
+                rays_d = rays_d.contiguous().pin_memory()
+            self._ray_cache[key] = (
+                rays_o.to(device, non_blocking=True),
+                rays_d.to(device, non_blocking=True),
+            )
+            if len(self._ray_cache) > self.ray_cache_size:
+                self._ray_cache.popitem(last=False)
+        return self._ray_cache[key]
+
+    @torch.inference_mode()
     def render(
         self,
         scene_codes,
@@ -120,122 +260,256 @@ class TSR(BaseModule):
         height: int = 256,
         width: int = 256,
         return_type: str = "pil",
+        view_chunk_size: int = 4,
     ):
-        rays_o, rays_d = get_spherical_cameras(
-            n_views, elevation_deg, camera_distance, fovy_deg, height, width
+        rays_o, rays_d = self.get_spherical_rays(
+            n_views,
+            elevation_deg,
+            camera_distance,
+            fovy_deg,
+            height,
+            width,
+            scene_codes.device,
         )
-        rays_o, rays_d = rays_o.to(scene_codes.device), rays_d.to(scene_codes.device)
 
         def process_output(image: torch.FloatTensor):
+            # image holds all views, (N_views, H, W, 3), so each scene needs one host copy
             if return_type == "pt":
-                return image
+                return list(image)
             elif return_type == "np":
-                return image.detach().cpu().numpy()
+                return list(image.detach().cpu().numpy())
             elif return_type == "pil":
-                return Image.fromarray(
-                    (image.detach().cpu().numpy() * 255.0).astype(np.uint8)
-                )
+                image = (image.detach().clamp(0, 1) * 255.0).to(torch.uint8)
+                return [Image.fromarray(image_) for image_ in image.cpu().numpy()]
             else:
                 raise NotImplementedError
 
         images = []
+        # scenes are rendered one by one, unlike the grid queries in extract_mesh: each
+        # scene already renders many views per batch and batching scenes would multiply
+        # the per-sample memory of a view chunk by the number of scenes
         for scene_code in scene_codes:
-            images_ = []
-            for i in range(n_views):
-                with torch.no_grad():
-                    image = self.renderer(
-                        self.decoder, scene_code, rays_o[i], rays_d[i]
-                    )
-                images_.append(process_output(image))
-            images.append(images_)
+            # render views as batched rays, (N_views, H, W, 3), view_chunk_size views at a time;
+            # every sample of every ray in a chunk is materialized (roughly 0.5 GB per 256^2
+            # view at 128 samples), so keep it small, 0 renders all views in one batch
+            with self.autocast(scene_codes.device):
+                # clone each chunk so results never alias buffers owned by a compiled
+                # (CUDA graph) renderer, which the next replay overwrites
+                image = chunk_batch(
+                    lambda o, d: self.renderer(self.decoder, scene_code, o, d).clone(),
+                    view_chunk_size,
+                    rays_o,
+                    rays_d,
+                )
+            image = image.float()
+            images.append(process_output(image))
 
         return images
 
     def set_marching_cubes_resolution(self, resolution: int):
-        logging.info('Setting marching cubes resolution...')
-        try:
-            if (
-                self.isosurface_helper is not None
-                and self.isosurface_helper.resolution == resolution
-            ):
-                logging.info('Marching cubes resolution is already set to the desired value.')
-                return
-            self.isosurface_helper = MarchingCubeHelper(resolution)
-            logging.info('Marching cubes resolution set successfully.')
-        except Exception as e:
-            logging.error('Failed to set marching cubes resolution: %s', e)
-
-    def extract_mesh(self, scene_codes, resolution: int = 256, threshold: float = 25.0):
-        logging.info('Starting mesh extraction...')
+        if (
+            self.isosurface_helper is not None
+            and self.isosurface_helper.resolution == resolution
+        ):
+            return
+        logger.debug("Setting marching cubes resolution to %d.", resolution)
+        self.isosurface_helper = MarchingCubeHelper(resolution)
+        self._scaled_grid_vertices = None
+
+    def get_scaled_grid_vertices(self, device: torch.device) -> torch.Tensor:
+        # only depends on the resolution and radius, so scale once and keep it on device
+        if (
+            self._scaled_grid_vertices is None
+            or self._scaled_grid_vertices.device != device
+        ):
+            self._scaled_grid_vertices = scale_tensor(
+                self.isosurface_helper.grid_vertices.to(device),
+                self.isosurface_helper.points_range,
+                (-self.renderer.cfg.radius, self.renderer.cfg.radius),
+            ).contiguous()
+        return self._scaled_grid_vertices
+
+    def query_grid_density(
+        self,
+        scene_codes: torch.Tensor,
+        grid_vertices: torch.Tensor,
+        chunk: int,
+        use_cuda_graph: bool = False,
+    ) -> torch.Tensor:
+        if chunk <= 0:
+            # 0 for no chunking, as in chunk_batch
+            chunk = grid_vertices.shape[0]
+        if use_cuda_graph and scene_codes.is_cuda:
+            return self._query_grid_density_graphed(scene_codes, grid_vertices, chunk)
+
+        # every scene shares the grid, so all scenes are queried in one batched call per chunk
+        density = []
+        for i in range(0, grid_vertices.shape[0], chunk):
+            x = grid_vertices[i : i + chunk]
+            density.append(
+                self.renderer.query_triplane(
+                    self.decoder, x[None].expand(scene_codes.shape[0], -1, -1), scene_codes
+                )["density_act"]
+            )
+        return torch.cat(density, dim=1)
+
+    def _query_grid_density_graphed(
+        self, scene_codes: torch.Tensor, grid_vertices: torch.Tensor, chunk: int
+    ) -> torch.Tensor:
+        # the per-chunk query has static shapes, so it is captured once into a CUDA graph
+        # and replayed for every chunk (and every later extraction with the same shapes)
+        batch_size, n_points = scene_codes.shape[0], grid_vertices.shape[0]
+        chunk = min(chunk, n_points)
+        # graphs replay raw addresses, so key on the decoder's parameter storage as well
+        key = (
+            chunk,
+            tuple(scene_codes.shape),
+            scene_codes.dtype,
+            str(scene_codes.device),
+            self.cfg.precision,
+            tuple(p.data_ptr() for p in self.decoder.parameters()),
+        )
+        if key not in self._density_graphs:
+            # keep a single graph alive, each one holds a private memory pool
+            self.release_cuda_graphs()
+            static_codes = scene_codes.clone()
+            static_points = grid_vertices[:chunk].clone()
+
+            def query():
+                # autocast's cast cache is not allowed during graph capture
+                with self.autocast(scene_codes.device, cache_enabled=False):
+                    return self.renderer.query_triplane(
+                        self.decoder,
+                        static_points[None].expand(batch_size, -1, -1),
+                        static_codes,
+                    )["density_act"]
+
+            # warm up on a side stream before capturing
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for _ in range(3):
+                    query()
+            torch.cuda.current_stream().wait_stream(stream)
+
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                static_density = query()
+            self._density_graphs[key] = (
+                graph,
+                static_codes,
+                static_points,
+                static_density,
+            )
+
+        graph, static_codes, static_points, static_density = self._density_graphs[key]
+        static_codes.copy_(scene_codes)
+        density = torch.empty(
+            batch_size,
+            n_points,
+            static_density.shape[-1],
+            dtype=static_density.dtype,
+            device=static_density.device,
+        )
+        for i in range(0, n_points, chunk):
+            # a short last chunk leaves stale points in the tail, their outputs are dropped
+            n = min(chunk, n_points - i)
+            static_points[:n].copy_(grid_vertices[i : i + n])
+            graph.replay()
+            density[:, i : i + n] = static_density[:, :n]
+        return density
+
+    def release_cuda_graphs(self):
+        """
+        Free the captured density query CUDA graphs and their memory pools.
+        """
+        self._density_graphs.clear()
+
+    def _to_numpy_staged(self, tensors: Dict[str, torch.Tensor]) -> Dict[str, np.ndarray]:
+        # copy device tensors into reused, grow-only pinned host buffers with async copies
+        # and a single sync; the returned arrays are views that the next call overwrites
+        if not all(t.is_cuda for t in tensors.values()):
+            return {k: t.cpu().numpy() for k, t in tensors.items()}
+
+        out = {}
+        for k, t in tensors.items():
+            buf = self._cpu_pool[k]
+            if buf is None or buf.dtype != t.dtype or buf.numel() < t.numel():
+                # grow with headroom, slowly growing meshes should not reallocate every call
+                size = t.numel()
+                if buf is not None and buf.dtype == t.dtype:
+                    size = max(size, int(1.5 * buf.numel()))
+                buf = torch.empty(size, dtype=t.dtype, pin_memory=True)
+                self._cpu_pool[k] = buf
+            staged = buf[: t.numel()].view(t.shape)
+            staged.copy_(t, non_blocking=True)
+            out[k] = staged
+        torch.cuda.current_stream(t.device).synchronize()
+        return {k: v.numpy() for k, v in out.items()}
+
+    def extract_mesh(
+        self,
+        scene_codes,
+        resolution: int = 256,
+        threshold: float = 25.0,
+        mc_chunk: int = 262144,
+        use_cuda_graph: bool = False,
+    ):
         try:
             self.set_marching_cubes_resolution(resolution)
-        except Exception as e:
-            logging.error('Failed to set marching cubes resolution: %s', e)
-            return None
+            # query the R^3 grid (and mesh vertices) mc_chunk points at a time to bound peak memory
+            grid_vertices = self.get_scaled_grid_vertices(scene_codes.device)
 
-        meshes = []
-        for scene_code in scene_codes:
-            logging.info('Processing scene code...')
-            try:
-                with torch.no_grad():
-                    logging.info('Querying triplane for density...')
-                    try:
-                        density = self.renderer.query_triplane(
-                            self.decoder,
-                            scale_tensor(
-                                self.isosurface_helper.grid_vertices.to(scene_codes.device),
-                                self.isosurface_helper.points_range,
-                                (-self.renderer.cfg.radius, self.renderer.cfg.radius),
-                            ),
-                            scene_code,
-                        )["density_act"]
-                    except Exception as e:
-                        logging.error('Failed to query triplane for density: %s', e)
-                        continue
-                    logging.info('Successfully queried triplane for density.')
-            except Exception as e:
-                logging.error('Failed to process scene code: %s', e)
-                continue
-            logging.info('Scene code processed successfully.')
-
-            try:
-                logging.info('Calculating v_pos and t_pos_idx...')
-                v_pos, t_pos_idx = self.isosurface_helper(-(density - threshold))
+            with torch.no_grad(), self.autocast(scene_codes.device):
+                densities = self.query_grid_density(
+                    scene_codes, grid_vertices, mc_chunk, use_cuda_graph
+                )
+            # marching cubes is sensitive to precision, keep density in fp32
+            densities = densities.float()
+
+            meshes = []
+            for scene_code, density in zip(scene_codes, densities):
+                v_pos, t_pos_idx = self.isosurface_helper(density, threshold, sign=1)
                 v_pos = scale_tensor(
                     v_pos,
                     self.isosurface_helper.points_range,
                     (-self.renderer.cfg.radius, self.renderer.cfg.radius),
                 )
-                logging.info('Successfully calculated v_pos and t_pos_idx.')
-            except Exception as e:
-                logging.error('Failed to calculate v_pos and t_pos_idx: %s', e)
-                continue
-
-            try:
-                logging.info('Querying triplane for color...')
-                with torch.no_grad():
-                    color = self.renderer.query_triplane(
-                        self.decoder,
+
+                with torch.no_grad(), self.autocast(scene_codes.device):
+                    color = chunk_batch(
+                        lambda x: self.renderer.query_triplane(
+                            self.decoder, x, scene_code
+                        )["color"],
+                        mc_chunk,
                         v_pos,
-                        scene_code,
-                    )["color"]
-                logging.info('Successfully queried triplane for color.')
-            except Exception as e:
-                logging.error('Failed to query triplane for color: %s', e)
-                continue
-
-            try:
-                logging.info('Creating and appending mesh...')
+                    ).float()
+
+                # narrow dtypes on device so less data crosses to the host, and make
+                # the arrays contiguous so each copy is a single transfer in the
+                # C-order layout trimesh expects
+                v_pos = v_pos.contiguous()
+                t_pos_idx = t_pos_idx.to(torch.int32).contiguous()
+                color = (color.clamp(0, 1) * 255).round().to(torch.uint8).contiguous()
+                # marching cubes output is already a clean indexed mesh, skip trimesh processing
+                arrays = self._to_numpy_staged({"v": v_pos, "f": t_pos_idx, "c": color})
+                # trimesh converts these into its own float64 / int64 / RGBA arrays,
+                # so the mesh never references the reused staging buffers
                 mesh = trimesh.Trimesh(
-                    vertices=v_pos.cpu().numpy(),
-                    faces=t_pos_idx.cpu().numpy(),
-                    vertex_colors=color.cpu().numpy(),
+                    vertices=arrays["v"],
+                    faces=arrays["f"],
+                    vertex_colors=arrays["c"],
+                    process=False,
                 )
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Extracted mesh with %d vertices and %d faces.",
+                        len(mesh.vertices),
+                        len(mesh.faces),
+                    )
                 meshes.append(mesh)
-                logging.info('Successfully created and appended mesh.')
-            except Exception as e:
-                logging.error('Failed to create and append mesh: %s', e)
-                continue
+        except Exception:
+            logger.exception("Failed to extract mesh.")
+            return None
 
-            logging.info('Mesh extraction completed.')
-            return meshes
\ No newline at end of file
+        return meshes
@@ -1,4 +1,5 @@
 import importlib
+import logging
 import math
 from collections import defaultdict
 from dataclasses import dataclass
@@ -14,6 +15,9 @@ import trimesh
 from omegaconf import DictConfig, OmegaConf
 from PIL import Image
 
+logger = logging.getLogger(__name__)
+
+
 def parse_structured(fields: Any, cfg: Optional[Union[dict, DictConfig]] = None) -> Any:
     scfg = OmegaConf.merge(OmegaConf.structured(fields), cfg)
     return scfg
@@ -59,21 +63,65 @@ class BaseModule(nn.Module):
         raise NotImplementedError
 
 
+def compile_fn(fn: Callable, **kwargs) -> Callable:
+    """
+    torch.compile `fn` unless it is already the output of torch.compile.
+    """
+    if hasattr(fn, "_torchdynamo_orig_callable"):
+        return fn
+    return torch.compile(fn, **kwargs)
+
+
+def jit_module(module: nn.Module) -> nn.Module:
+    """
+    Script `module` with TorchScript, falling back to compiling its forward with
+    torch.compile when the module is not scriptable. The fallback patches the
+    forward in place so parameter names, and thus checkpoint keys, are unchanged.
+    """
+    try:
+        return torch.jit.script(module)
+    except Exception as e:
+        logger.info(
+            "Could not script %s (%s), using torch.compile instead.",
+            type(module).__name__,
+            e,
+        )
+        module.forward = compile_fn(module.forward, fullgraph=False, dynamic=False)
+        return module
+
+
 class ImagePreprocessor:
-    def convert_and_resize(
+    def to_tensor(
         self,
         image: Union[PIL.Image.Image, np.ndarray, torch.Tensor],
-        size: int,
-    ):
+    ) -> torch.Tensor:
+        # uint8 inputs stay uint8 so they are cast to float only after moving to device
         if isinstance(image, PIL.Image.Image):
-            image = torch.from_numpy(np.array(image).astype(np.float32) / 255.0)
+            image = torch.from_numpy(np.array(image))
         elif isinstance(image, np.ndarray):
-            if image.dtype == np.uint8:
-                image = torch.from_numpy(image.astype(np.float32) / 255.0)
-            else:
-                image = torch.from_numpy(image)
+            image = torch.from_numpy(image)
         elif isinstance(image, torch.Tensor):
             pass
+        return image
+
+    def convert_and_resize(
+        self,
+        image: Union[PIL.Image.Image, np.ndarray, torch.Tensor],
+        size: int,
+        device: Optional[Union[str, torch.device]] = None,
+    ):
+        image = self.to_tensor(image)
+        if (
+            device is not None
+            and torch.device(device).type == "cuda"
+            and image.device.type == "cpu"
+        ):
+            # stage in pinned memory so the host-to-device copy is asynchronous
+            image = image.pin_memory().to(device, non_blocking=True)
+        else:
+            image = image.to(device)
+        if image.dtype == torch.uint8:
+            image = image.float() / 255.0
 
         batched = image.ndim == 4
 
@@ -101,14 +149,23 @@ class ImagePreprocessor:
             List[torch.FloatTensor],
         ],
         size: int,
+        device: Optional[Union[str, torch.device]] = None,
     ) -> Any:
         if isinstance(image, (np.ndarray, torch.FloatTensor)) and image.ndim == 4:
-            image = self.convert_and_resize(image, size)
+            image = self.convert_and_resize(image, size, device)
         else:
             if not isinstance(image, list):
                 image = [image]
-            image = [self.convert_and_resize(im, size) for im in image]
-            image = torch.stack(image, dim=0)
+            image = [self.to_tensor(im) for im in image]
+            if all(
+                im.shape == image[0].shape and im.dtype == image[0].dtype
+                for im in image
+            ):
+                # equally sized images are resized together as one batch
+                image = self.convert_and_resize(torch.stack(image, dim=0), size, device)
+            else:
+                image = [self.convert_and_resize(im, size, device) for im in image]
+                image = torch.stack(image, dim=0)
         return image
 
 